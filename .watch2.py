@@ -6,11 +6,24 @@ import vlc
 import argparse
 import random
 import time
+import fcntl
+import mmap
+import struct
+import hashlib
+import re
+import socket
+import threading
+import tracemalloc
+from collections import deque
+import numpy as np
+from contextlib import contextmanager
 from pprint import pprint
 from rich.console import Console
 from rich.progress import Progress
+from rich.table import Table
 from Levenshtein import distance as levenshtein_distance  # Import Levenshtein library
 import subprocess
+import tempfile
 import unittest
 from unittest.mock import patch, mock_open, MagicMock
 
@@ -20,6 +33,9 @@ def dier (msg):
 
 db_entries = None
 
+# Position up to which ~/.db.txt has already been merged into db_entries
+db_follow_state = {"inode": None, "offset": 0}
+
 console = Console()
 
 parser = argparse.ArgumentParser(description='Process some options.')
@@ -29,6 +45,14 @@ parser.add_argument('--serie', type=str, default="", help='Set series name.')
 parser.add_argument('--staffel', type=int, default=-1, help='Season.')
 parser.add_argument('--min_staffel', type=int, default=-1, help='Season.')
 parser.add_argument('--max_staffel', type=int, default=-1, help='Season.')
+parser.add_argument('--fingerprints', action='store_true', default=False, help='Recognize renamed or moved episodes by a fingerprint of their content.')
+parser.add_argument('--live_intro', action='store_true', default=False, help='Detect and skip the intro during playback if it is not in .intro_endtime yet.')
+parser.add_argument('--simulate', type=int, default=0, help='Simulate the selection on a library with this many episodes and exit.')
+parser.add_argument('--simulate_plays', type=int, default=10000, help='Number of plays to simulate.')
+parser.add_argument('--simulate_strategy', type=str, default='select_mp4_file', choices=['select_mp4_file', 'numpy'], help='Selection strategy to simulate.')
+parser.add_argument('--simulate_memory', action='store_true', default=False, help='Trace the peak memory of --simulate with tracemalloc (makes picking much slower).')
+parser.add_argument('--seed', type=int, default=0, help='Random seed for --simulate.')
+parser.add_argument('--stats', action='store_true', default=False, help='Show statistics from the play archive and exit.')
 
 args = parser.parse_args()
 
@@ -120,24 +144,84 @@ def find_series_directory(serie_name: str, maindir: str) -> str:
 
     error("No suitable series directory found.", 3)
 
+def parse_db_line(line):
+    """Parses a '"path":::unix_time' line into (normalized_path, unix_time)."""
+    path, unix_time = line.strip().split(':::')
+    path = path.strip('"')
+    normalized_path = path.replace('/', '').replace('\\', '')
+    return normalized_path, int(unix_time)
+
 def load_db_file(db_file_path):
     if not os.path.isfile(db_file_path):
         return {}
 
     _db_entries = {}
-    with open(db_file_path, 'r') as db_file:
-        for line in db_file:
-            path, unix_time = line.strip().split(':::')
-            path = path.strip('"')  # <-- ADD THIS LINE
-            normalized_path = path.replace('/', '').replace('\\', '')
-            if normalized_path in _db_entries:
-                if _db_entries[normalized_path] < int(unix_time):
-                    _db_entries[normalized_path] = int(unix_time)
-            else:
-                _db_entries[normalized_path] = int(unix_time)
+    follow_db_file(db_file_path, _db_entries, reset=True)
 
     return _db_entries
 
+def follow_db_file(db_file_path, entries, reset=False):
+    """Merges lines appended to the .db.txt file since the last call into entries.
+
+    Other watcher instances append to the same file, so instead of reloading it
+    completely before every pick, only the new tail is read. If the file was
+    replaced by clean_db_file (inode changed) or shrank, it is read again from
+    the start. Incomplete trailing lines are left for the next call."""
+    try:
+        db_file = open(db_file_path, 'rb')
+    except FileNotFoundError:
+        return entries
+
+    # Inode and size must come from the opened file, the path may be replaced meanwhile
+    with db_file:
+        stat = os.fstat(db_file.fileno())
+
+        if reset or stat.st_ino != db_follow_state["inode"] or stat.st_size < db_follow_state["offset"]:
+            debug(f"Reading {db_file_path} from the beginning")
+            db_follow_state["inode"] = stat.st_ino
+            db_follow_state["offset"] = 0
+
+        if stat.st_size == db_follow_state["offset"]:
+            return entries
+
+        db_file.seek(db_follow_state["offset"])
+        data = db_file.read(stat.st_size - db_follow_state["offset"])
+
+    complete = data[:data.rfind(b'\n') + 1]
+    db_follow_state["offset"] += len(complete)
+
+    for line in complete.decode(errors='replace').splitlines():
+        if ':::' not in line:
+            continue
+        try:
+            normalized_path, unix_time = parse_db_line(line)
+        except ValueError:
+            debug(f"Ignoring malformed line: {line}")
+            continue
+        if entries.get(normalized_path, 0) < unix_time:
+            entries[normalized_path] = unix_time
+
+    return entries
+
+@contextmanager
+def locked_db_file(db_file_path):
+    """Holds an exclusive lock on <db_file_path>.lock while the .db.txt file is written.
+
+    A separate lock file is used because clean_db_file replaces the .db.txt file,
+    and a lock on the replaced inode would not be seen by other instances."""
+    old_umask = os.umask(0)
+    try:
+        lock_file = open(f"{db_file_path}.lock", 'a')
+    finally:
+        os.umask(old_umask)
+
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
 def clean_db_file(db_file_path):
     """Cleans the .db.txt file, keeping only the newest entry for each mp4_file."""
     # Überprüfen, ob der Dateipfad gültig ist
@@ -145,6 +229,12 @@ def clean_db_file(db_file_path):
     if not db_file_path or not isinstance(db_file_path, str):
         raise ValueError(f"Invalid file path: {db_file_path}")
 
+    # Andere Instanzen dürfen während des Bereinigens nichts anhängen
+    with locked_db_file(db_file_path):
+        clean_locked_db_file(db_file_path)
+
+def clean_locked_db_file(db_file_path):
+    """Does the actual cleaning; the caller must hold locked_db_file()."""
     # Datei erstellen, falls sie nicht existiert
     if not os.path.exists(db_file_path):
         try:
@@ -189,20 +279,29 @@ def clean_db_file(db_file_path):
         else:
             print(f"[WARNING] Ignoring malformed line {idx}: {line.strip()}")
 
+    if len(latest_entries) == len(lines):
+        debug(f"{db_file_path} contains no duplicates, not rewriting it.")
+        return
+
     old_umask = os.umask(0)
-    # Bereinigte Datei schreiben
+    # Bereinigte Datei in eine temporäre Datei schreiben und atomar ersetzen,
+    # damit lesende Instanzen nie eine halb geschriebene Datei sehen
+    tmp_file_path = f"{db_file_path}.tmp"
     try:
         debug(f"Checking write permissions for {db_file_path}.")
         if not os.access(db_file_path, os.W_OK):
             raise PermissionError(f"File {db_file_path} is not writable.")
 
-        debug(f"Opening {db_file_path} for writing.")
-        with open(db_file_path, 'w') as db_file:
+        debug(f"Opening {tmp_file_path} for writing.")
+        with open(tmp_file_path, 'w') as db_file:
             for entry, unix_time in latest_entries.items():
                 entry = entry.replace('"', '')
                 new_line = f'"{entry}":::{unix_time}\n'
                 debug(f"Writing line: {new_line.strip()}")
                 db_file.write(new_line)
+            db_file.flush()
+            os.fsync(db_file.fileno())
+        os.replace(tmp_file_path, db_file_path)
     except PermissionError as e:
         print(f"[ERROR] Permission error while writing {db_file_path}: {e}")
         sys.exit(5)
@@ -215,14 +314,287 @@ def clean_db_file(db_file_path):
     debug(f"Successfully cleaned and updated {db_file_path}.")
 
 def update_db_file(db_file_path, mp4_file, unix_time):
-    clean_db_file(db_file_path)
+    """Appends the new entry to the .db.txt file.
+
+    The append happens under the same lock clean_db_file uses, so entries
+    written concurrently by other watcher instances are never lost."""
+    with locked_db_file(db_file_path):
+        with open(db_file_path, 'a') as db_file:
+            db_file.write(f"\"{mp4_file}\":::{unix_time}\n")
+
+def get_archive_paths(archive_dir):
+    """Returns the episode table and the two column files of the play archive."""
+    return (
+        os.path.join(archive_dir, "episodes.txt"),
+        os.path.join(archive_dir, "episode_ids.u32"),
+        os.path.join(archive_dir, "timestamps.i64")
+    )
+
+def read_archive_episodes(episodes_path):
+    """Returns the archived episode paths, the line number is the episode ID."""
+    try:
+        with open(episodes_path, 'r') as episodes_file:
+            return [line.rstrip('\n') for line in episodes_file]
+    except FileNotFoundError:
+        return []
+
+def archive_play(archive_dir, mp4_file, unix_time):
+    """Appends a play to the archive, which, unlike .db.txt, is never cleaned.
+
+    Every play is stored as one fixed-width record split over two column files,
+    a little-endian uint32 episode ID and an int64 unix time."""
+    episodes_path, ids_path, times_path = get_archive_paths(archive_dir)
+    path = os.path.normpath(mp4_file)
+
+    os.makedirs(archive_dir, exist_ok=True)
+    with locked_db_file(archive_dir):
+        episodes = read_archive_episodes(episodes_path)
+        if path in episodes:
+            episode_id = episodes.index(path)
+        else:
+            episode_id = len(episodes)
+            with open(episodes_path, 'a') as episodes_file:
+                episodes_file.write(f"{path}\n")
+
+        # An interrupted append can leave one column longer than the other
+        nr_of_plays = min(
+            os.path.getsize(ids_path) // 4 if os.path.exists(ids_path) else 0,
+            os.path.getsize(times_path) // 8 if os.path.exists(times_path) else 0
+        )
+
+        with open(ids_path, 'ab') as ids_file, open(times_path, 'ab') as times_file:
+            ids_file.truncate(nr_of_plays * 4)
+            times_file.truncate(nr_of_plays * 8)
+            ids_file.write(struct.pack('<I', episode_id))
+            times_file.write(struct.pack('<q', int(unix_time)))
+
+def read_archive_column(path, dtype):
+    """Maps a column file into memory and returns it as a read-only NumPy array."""
+    dtype = np.dtype(dtype)
+    try:
+        with open(path, 'rb') as column_file:
+            size = os.fstat(column_file.fileno()).st_size
+            if size < dtype.itemsize:
+                return np.zeros(0, dtype=dtype)
+            mapped = mmap.mmap(column_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return np.zeros(0, dtype=dtype)
+
+    return np.frombuffer(mapped, dtype=dtype, count=size // dtype.itemsize)
+
+def load_play_archive(archive_dir):
+    """Returns (episode_paths, episode_ids, timestamps) of all archived plays."""
+    episodes_path, ids_path, times_path = get_archive_paths(archive_dir)
+    episode_ids = read_archive_column(ids_path, '<u4')
+    timestamps = read_archive_column(times_path, '<i8')
+    nr_of_plays = min(len(episode_ids), len(timestamps))
+
+    return read_archive_episodes(episodes_path), episode_ids[:nr_of_plays], timestamps[:nr_of_plays]
+
+def rename_archive_episode(archive_dir, old_key, new_path):
+    """Points the archived plays of the episode with db key old_key to new_path.
+
+    Returns False if the archive has no such episode or already has new_path,
+    in which case the archive is left unchanged."""
+    episodes_path = get_archive_paths(archive_dir)[0]
+    new_path = os.path.normpath(new_path)
+
+    if not os.path.isdir(archive_dir):
+        return False
+
+    with locked_db_file(archive_dir):
+        episodes = read_archive_episodes(episodes_path)
+        if new_path in episodes:
+            return False
+
+        keys = [path.replace('/', '').replace('\\', '') for path in episodes]
+        if old_key not in keys:
+            return False
+
+        episodes[keys.index(old_key)] = new_path
+        with open(f"{episodes_path}.tmp", 'w') as episodes_file:
+            episodes_file.write(''.join(f"{path}\n" for path in episodes))
+        os.replace(f"{episodes_path}.tmp", episodes_path)
+
+    return True
+
+STALENESS_BINS = [0, 1, 7, 30, 90, 365, np.inf]
+
+def compute_play_stats(mp4_files, episode_paths, episode_ids, timestamps, now):
+    """Computes the --stats report for the given episodes from the archived plays."""
+    library = [os.path.normpath(mp4_file) for mp4_file in mp4_files]
+    library_index = {path: idx for idx, path in enumerate(library)}
+
+    # Archive episode ID -> index in mp4_files, -1 for episodes of other series
+    id_to_library = np.array([library_index.get(path, -1) for path in episode_paths] + [-1], dtype=np.int64)
+    library_ids = id_to_library[np.minimum(episode_ids, len(episode_paths))]
+    in_library = library_ids >= 0
+    library_ids = library_ids[in_library]
+    play_times = timestamps[in_library]
+
+    plays = np.bincount(library_ids, minlength=len(library))
+    last_played = np.zeros(len(library), dtype=np.int64)
+    np.maximum.at(last_played, library_ids, play_times)
+
+    seasons = np.array([int(os.path.basename(os.path.dirname(path))) for path in library], dtype=np.int64)
+    season_numbers, season_index = np.unique(seasons, return_inverse=True)
+    watched = plays > 0
+
+    staleness_days = (now - last_played[watched]) / 86400
+    staleness_histogram, _ = np.histogram(staleness_days, bins=STALENESS_BINS)
+
+    return {
+        "seasons": season_numbers.tolist(),
+        "plays_per_season": np.bincount(season_index, weights=plays, minlength=len(season_numbers)).astype(int).tolist(),
+        "episodes_per_season": np.bincount(season_index, minlength=len(season_numbers)).tolist(),
+        "watched_per_season": np.bincount(season_index, weights=watched, minlength=len(season_numbers)).astype(int).tolist(),
+        "total_plays": int(plays.sum()),
+        "coverage": float(watched.mean()) if len(library) else 0.0,
+        "never_watched": int((~watched).sum()),
+        "staleness_histogram": staleness_histogram.tolist()
+    }
+
+def print_play_stats(stats):
+    """Prints the --stats report."""
+    table = Table(title="Plays per season")
+    table.add_column("Season", justify="right")
+    table.add_column("Plays", justify="right")
+    table.add_column("Watched", justify="right")
+    table.add_column("Coverage", justify="right")
+
+    for season, plays, watched, episodes in zip(stats["seasons"], stats["plays_per_season"], stats["watched_per_season"], stats["episodes_per_season"]):
+        table.add_row(str(season), str(plays), f"{watched}/{episodes}", f"{watched / episodes:.0%}")
+
+    console.print(table)
+
+    staleness = Table(title="Days since last play")
+    staleness.add_column("Days")
+    staleness.add_column("Episodes", justify="right")
+
+    for lower, upper, count in zip(STALENESS_BINS, STALENESS_BINS[1:], stats["staleness_histogram"]):
+        label = f">= {lower}" if upper == np.inf else f"{lower}-{upper}"
+        staleness.add_row(label, str(count))
+    staleness.add_row("never", str(stats["never_watched"]))
+
+    console.print(staleness)
+    console.print(f"[bold]Total plays:[/bold] {stats['total_plays']}, [bold]coverage:[/bold] {stats['coverage']:.1%}, [bold]never watched:[/bold] {stats['never_watched']}")
+
+def fingerprint_file(file_path, block_size=4096, nr_of_blocks=5):
+    """Returns a fingerprint of the file size and a few evenly spaced blocks.
+
+    Only nr_of_blocks * block_size bytes are read through mmap, so a whole
+    library can be fingerprinted without reading every file completely."""
+    fingerprint = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        fingerprint.update(size.to_bytes(8, 'little'))
+        if size > 0:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if size <= block_size * nr_of_blocks:
+                    fingerprint.update(mapped[:])
+                else:
+                    step = (size - block_size) // (nr_of_blocks - 1)
+                    for i in range(nr_of_blocks):
+                        fingerprint.update(mapped[i * step:i * step + block_size])
+
+    return f"{size:x}-{fingerprint.hexdigest()}"
+
+def load_fingerprint_index(index_path):
+    """Loads the fingerprint index, lines are '"db_key":::dev:inode:mtime_ns:::fingerprint'."""
+    index = {"by_stat": {}, "by_fingerprint": {}, "changed": False}
+    if not os.path.isfile(index_path):
+        return index
 
-    """Updates the .db.txt file with the new entry."""
-    with open(db_file_path, 'a') as db_file:
-        db_file.write(f"\"{mp4_file}\":::{unix_time}\n")
+    with open(index_path, 'r') as index_file:
+        for line in index_file:
+            try:
+                db_key, stat_key, fingerprint = line.strip().split(':::')
+            except ValueError:
+                debug(f"Ignoring malformed line in {index_path}: {line.strip()}")
+                continue
+            index["by_stat"][stat_key] = fingerprint
+            index["by_fingerprint"][fingerprint] = db_key.strip('"')
+
+    return index
+
+def save_fingerprint_index(index_path, index):
+    """Writes the fingerprint index if it changed.
 
-def select_mp4_file(mp4_files, db_file_path, last_played=None):
+    The file is shared by all running instances, so it is re-read under the lock
+    and merged, with this instance's entries winning on conflict."""
+    if not index["changed"]:
+        return
+
+    with locked_db_file(index_path):
+        on_disk = load_fingerprint_index(index_path)
+        fingerprint_to_stat = {fingerprint: stat_key for stat_key, fingerprint in on_disk["by_stat"].items()}
+        fingerprint_to_stat.update({fingerprint: stat_key for stat_key, fingerprint in index["by_stat"].items()})
+        by_fingerprint = {**on_disk["by_fingerprint"], **index["by_fingerprint"]}
+        with open(f"{index_path}.tmp", 'w') as index_file:
+            for fingerprint, db_key in by_fingerprint.items():
+                if fingerprint in fingerprint_to_stat:
+                    index_file.write(f'"{db_key}":::{fingerprint_to_stat[fingerprint]}:::{fingerprint}\n')
+        os.replace(f"{index_path}.tmp", index_path)
+
+    index["changed"] = False
+
+def get_fingerprint(index, mp4_file):
+    """Returns the fingerprint of mp4_file, computed only if device, inode or mtime changed."""
+    stat = os.stat(mp4_file)
+    stat_key = f"{stat.st_dev}:{stat.st_ino}:{stat.st_mtime_ns}"
+    if stat_key not in index["by_stat"]:
+        index["by_stat"][stat_key] = fingerprint_file(mp4_file)
+        index["changed"] = True
+
+    return index["by_stat"][stat_key]
+
+def rekey_renamed_files(mp4_files, db_file_path, index, archive_dir=None):
+    """Moves the history of renamed or moved files to their new path.
+
+    A file whose path has no entry in db_entries but whose fingerprint was
+    seen under another path that has one gets that entry under its new path.
+    Its plays in the archive in archive_dir are moved to the new path, too."""
     global db_entries
+
+    with Progress(transient=True) as progress:
+        task = progress.add_task("[cyan]Fingerprinting MP4 files...", total=len(mp4_files))
+
+        for mp4_file in mp4_files:
+            db_key = os.path.normpath(mp4_file).replace('/', '').replace('\\', '')
+            fingerprint = get_fingerprint(index, mp4_file)
+            old_key = index["by_fingerprint"].get(fingerprint)
+
+            if db_key not in db_entries and old_key in db_entries:
+                debug(f"{mp4_file} was renamed, taking over the history of {old_key}")
+                db_entries[db_key] = db_entries[old_key]
+                update_db_file(db_file_path, mp4_file, db_entries[old_key])
+                if archive_dir is not None:
+                    rename_archive_episode(archive_dir, old_key, mp4_file)
+
+            if old_key != db_key:
+                index["by_fingerprint"][fingerprint] = db_key
+                index["changed"] = True
+
+            progress.update(task, advance=1)
+
+# Chance to pick among never played files while there are any
+NEVER_PLAYED_PREFERENCE = 0.8
+
+def selection_weights(now, last_played_times):
+    """Weights for the weighted pick, the seconds since each last play, at least 1.
+
+    Shared by select_mp4_file and select_mp4_file_numpy so both follow the same rule."""
+    return np.maximum(now - np.asarray(last_played_times, dtype=np.float64), 1.0)
+
+def select_mp4_file(mp4_files, db_file_path, last_played=None, entries=None, clock=None, rng=None, check_exists=True):
+    """Selects the next file, preferring never played and long unplayed ones.
+
+    entries, clock and rng default to db_entries, time.time and the random module.
+    The selection simulator injects its own to run on a virtual clock."""
+    global db_entries
+    entries = db_entries if entries is None else entries
+    clock = clock or time.time
+    rng = rng or random
     candidates = []
     normalized_last_played = os.path.normpath(last_played) if last_played else None
 
@@ -233,9 +605,9 @@ def select_mp4_file(mp4_files, db_file_path, last_played=None):
             debug(f"Skipping last played file: {mp4_file}")
             continue
 
-        if os.path.exists(mp4_file):  # Verify file actually exists on disk
+        if not check_exists or os.path.exists(mp4_file):  # Verify file actually exists on disk
             db_key = normalized_path.replace('/', '').replace('\\', '')
-            last_played_time = db_entries.get(db_key, 0)
+            last_played_time = entries.get(db_key, 0)
             candidates.append((mp4_file, last_played_time))
         else:
             debug(f"File in list but not on disk, skipping: {mp4_file}")
@@ -248,15 +620,142 @@ def select_mp4_file(mp4_files, db_file_path, last_played=None):
     played_before = [c for c in candidates if c[1] != 0]
 
     # Prioritize never-played files (e.g., 80% chance to pick from them if available)
-    if never_played and random.random() < 0.8:
-        return random.choice(never_played)[0]
+    if never_played and rng.random() < NEVER_PLAYED_PREFERENCE:
+        return rng.choice(never_played)[0]
 
     # Otherwise, fall back to weighted selection from all candidates
-    current_time = time.time()
-    weights = [max(current_time - entry[1], 1.0) for entry in candidates]
-    selection = random.choices(candidates, weights=weights, k=1)
+    current_time = clock()
+    weights = selection_weights(current_time, [entry[1] for entry in candidates]).tolist()
+    selection = rng.choices(candidates, weights=weights, k=1)
     return selection[0][0]
 
+def select_mp4_file_numpy(last_played_times, last_index, now, rng):
+    """NumPy version of the rule in select_mp4_file, on an array of last played times.
+
+    Used by the simulator to compare against select_mp4_file on large libraries."""
+    candidates = np.ones(len(last_played_times), dtype=bool)
+    if last_index >= 0:
+        candidates[last_index] = False
+
+    never_played = np.flatnonzero(candidates & (last_played_times == 0))
+    if len(never_played) and rng.random() < NEVER_PLAYED_PREFERENCE:
+        return int(rng.choice(never_played))
+
+    weights = np.where(candidates, selection_weights(now, last_played_times), 0.0)
+    cumulative = np.cumsum(weights)
+    return int(np.searchsorted(cumulative, rng.random() * cumulative[-1], side='right'))
+
+SIMULATION_START = 1700000000
+
+def simulate_selection(nr_of_episodes, nr_of_plays, strategy='select_mp4_file', seed=0, play_seconds=1320, episodes_per_season=25, trace_memory=False):
+    """Plays nr_of_plays episodes of a synthetic library on a virtual clock.
+
+    Every play takes play_seconds of virtual time. Only the time spent selecting
+    is measured for the picks per second. With trace_memory, the peak memory of
+    the simulation itself is traced with tracemalloc, which makes picking many
+    times slower, so picks per second of such a run are not comparable."""
+    was_tracing = tracemalloc.is_tracing()
+    if trace_memory:
+        if not was_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        traced_before = tracemalloc.get_traced_memory()[0]
+
+    mp4_files = [f"/simulation/{i // episodes_per_season + 1}/{i:06d}.mp4" for i in range(nr_of_episodes)]
+    file_index = {mp4_file: i for i, mp4_file in enumerate(mp4_files)}
+    db_keys = [os.path.normpath(mp4_file).replace('/', '') for mp4_file in mp4_files]
+
+    virtual_time = [SIMULATION_START]
+    last_played_times = np.zeros(nr_of_episodes, dtype=np.int64)
+    last_pick = np.full(nr_of_episodes, -1, dtype=np.int64)
+    staleness = np.full(nr_of_plays, np.nan)
+    repeat_intervals = np.full(nr_of_plays, -1, dtype=np.int64)
+
+    if strategy == 'select_mp4_file':
+        entries = {}
+        rng = random.Random(seed)
+        pick = lambda last: file_index[select_mp4_file(mp4_files, None, mp4_files[last] if last >= 0 else None, entries, lambda: virtual_time[0], rng, check_exists=False)]
+    elif strategy == 'numpy':
+        entries = None
+        rng = np.random.default_rng(seed)
+        pick = lambda last: select_mp4_file_numpy(last_played_times, last, virtual_time[0], rng)
+    else:
+        raise ValueError(f"Unknown strategy: {strategy}")
+
+    selection_seconds = 0
+    nr_seen = 0
+    all_seen = None
+    last = -1
+
+    for play in range(nr_of_plays):
+        selection_start = time.perf_counter()
+        i = pick(last)
+        selection_seconds += time.perf_counter() - selection_start
+
+        if last_pick[i] >= 0:
+            staleness[play] = virtual_time[0] - last_played_times[i]
+            repeat_intervals[play] = play - last_pick[i]
+        else:
+            nr_seen += 1
+            if nr_seen == nr_of_episodes:
+                all_seen = (play + 1, virtual_time[0] + play_seconds - SIMULATION_START)
+
+        virtual_time[0] += play_seconds
+        last_pick[i] = play
+        last_played_times[i] = virtual_time[0]
+        if entries is not None:
+            entries[db_keys[i]] = virtual_time[0]
+        last = i
+
+    repeats = repeat_intervals[repeat_intervals >= 0]
+    staleness_days = staleness[~np.isnan(staleness)] / 86400
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1] - traced_before
+        if not was_tracing:
+            tracemalloc.stop()
+
+    return {
+        "strategy": strategy,
+        "episodes": nr_of_episodes,
+        "plays": nr_of_plays,
+        "picks_per_second": nr_of_plays / selection_seconds if selection_seconds > 0 else float('inf'),
+        "peak_memory_mb": peak_memory / 1024 / 1024 if peak_memory is not None else None,
+        "never_played_picks": int(nr_of_plays - len(repeats)),
+        "staleness_days": {
+            "median": float(np.median(staleness_days)) if len(staleness_days) else None,
+            "mean": float(staleness_days.mean()) if len(staleness_days) else None,
+            "p5": float(np.percentile(staleness_days, 5)) if len(staleness_days) else None
+        },
+        "repeat_interval": {
+            "min": int(repeats.min()) if len(repeats) else None,
+            "median": float(np.median(repeats)) if len(repeats) else None,
+            "mean": float(repeats.mean()) if len(repeats) else None
+        },
+        "all_seen_after_plays": all_seen[0] if all_seen else None,
+        "all_seen_after_days": all_seen[1] / 86400 if all_seen else None
+    }
+
+def print_simulation(result):
+    """Prints the result of simulate_selection."""
+    def fmt(value, unit=""):
+        return "-" if value is None else f"{value:.2f}{unit}" if isinstance(value, float) else f"{value}{unit}"
+
+    table = Table(title=f"Simulated {result['plays']} plays of {result['episodes']} episodes ({result['strategy']})")
+    table.add_column("Metric")
+    table.add_column("Value", justify="right")
+
+    table.add_row("Picks per second", fmt(result["picks_per_second"]))
+    table.add_row("Peak memory", fmt(result["peak_memory_mb"], " MB"))
+    table.add_row("Never played picks", fmt(result["never_played_picks"]))
+    for name, value in result["staleness_days"].items():
+        table.add_row(f"Staleness at pick ({name})", fmt(value, " days"))
+    for name, value in result["repeat_interval"].items():
+        table.add_row(f"Plays between repeats ({name})", fmt(value))
+    table.add_row("All episodes seen after", f"{fmt(result['all_seen_after_plays'])} plays / {fmt(result['all_seen_after_days'], ' days')}")
+
+    console.print(table)
+
 def get_skip_value(filename, filepath):
     try:
         with open(filepath, 'r') as file:
@@ -272,6 +771,118 @@ def get_skip_value(filename, filepath):
         debug(f"The file {filepath} was not found.")
         return None
 
+def stream_frame_hashes(video_path, stop_event, seconds=120, size=(64, 36)):
+    """Yields (frame, average_hash) of the first seconds of the video at 2 frames per second.
+
+    ffmpeg decodes much faster than real time and only small frames are hashed,
+    so this runs well ahead of the playback."""
+    import imagehash
+    from PIL import Image
+
+    width, height = size
+    frame_size = width * height * 3
+    process = subprocess.Popen(
+        ['ffmpeg', '-v', 'quiet', '-i', video_path, '-t', str(seconds), '-vf', f'fps=2,scale={width}:{height}', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-'],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+
+    try:
+        frame = 0
+        while not stop_event.is_set():
+            data = process.stdout.read(frame_size)
+            if len(data) < frame_size:
+                break
+            frame += 1
+            yield frame, str(imagehash.average_hash(Image.frombytes('RGB', size, data)))
+    finally:
+        process.kill()
+        process.wait()
+
+def find_intro_end(frame_hashes, template, max_distance=8):
+    """Returns the last frame of the intro, compared against only the newest len(template) frames.
+
+    A window within max_distance bits per frame is confirmed as soon as the
+    next window matches worse, so the intro end is not taken a frame early."""
+    template_values = [int(h, 16) for h in template]
+    recent = deque(maxlen=len(template_values))
+    candidate = None
+
+    for frame, frame_hash in frame_hashes:
+        recent.append(int(frame_hash, 16))
+        if len(recent) < len(template_values):
+            continue
+
+        distance = sum(bin(a ^ b).count('1') for a, b in zip(recent, template_values)) / len(template_values)
+
+        if candidate is not None and distance >= candidate[1]:
+            return candidate[0]
+        if distance <= max_distance:
+            candidate = (frame, distance)
+
+    return candidate[0] if candidate is not None else None
+
+def find_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def vlc_rc_command(port, command, retries=10):
+    """Sends a command to VLC's rc interface and returns what VLC answered."""
+    for _ in range(retries):
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1) as sock:
+                sock.sendall(f"{command}\n".encode())
+                time.sleep(0.2)
+                try:
+                    return sock.recv(4096).decode(errors='replace')
+                except socket.timeout:
+                    return ""
+        except OSError:
+            time.sleep(0.5)
+
+    debug(f"Could not connect to VLC on port {port}")
+    return None
+
+def is_plausible_intro_end(end_frame, template_length, window_frames):
+    """Checks if an intro of template_length frames can end at end_frame.
+
+    The intro has to start in the first half of the streamed window and end
+    before the window does. A match found only when the stream ran out, or a
+    template much longer than an intro, ends too late and is rejected."""
+    intro_start = end_frame - template_length + 1
+    return 1 <= intro_start <= window_frames // 2 and end_frame < window_frames
+
+def skip_intro_live(video_path, template, port, stop_event, intro_skipper_file, seconds=120):
+    """Finds the intro end while the video plays, seeks VLC past it and saves it to .intro_endtime."""
+    started = time.time()
+    end_frame = find_intro_end(stream_frame_hashes(video_path, stop_event, seconds), template)
+
+    if end_frame is None or stop_event.is_set():
+        debug(f"No intro found in {video_path}")
+        return
+
+    if not is_plausible_intro_end(end_frame, len(template), seconds * 2):
+        console.print(f"[bold yellow]Ignoring intro match ending at frame {end_frame}, a {len(template)} frame intro cannot end there.[/bold yellow]")
+        return
+
+    end_time = end_frame // 2  # Adjust frame to time (2 fps), like intro_cutter.py
+    latency = time.time() - started
+    debug(f"Intro of {video_path} ends at {end_time}s, found after {latency:.1f}s")
+    if latency > len(template) / 2:
+        console.print(f"[bold yellow]Intro detection took {latency:.1f}s, longer than the intro itself.[/bold yellow]")
+
+    answer = vlc_rc_command(port, "get_time")
+    current = re.findall(r'(?m)^[>\s]*(\d+)\s*$', answer or "")
+    if not current or int(current[-1]) < end_time:
+        vlc_rc_command(port, f"seek {end_time}")
+
+    # A single O_APPEND write, so lines from intro_cutter.py or other watchers are not mixed
+    fd = os.open(intro_skipper_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, f"{os.path.basename(video_path)} ::: {end_time}\n".encode())
+    finally:
+        os.close(fd)
+
 def play_video(video_path):
     # Start VLC player with the video and option to close VLC when the video ends
     # Trying to start VLC with a non-existing file to check if it will exit on its own.
@@ -283,14 +894,32 @@ def play_video(video_path):
 
     start_time = get_skip_value(file_name, intro_skipper_file)
 
+    template = None
+    if start_time is None and args.live_intro:
+        from intro_cutter import get_template_path, load_intro_template
+        template = load_intro_template(get_template_path(folder_path))
+        if template is None:
+            debug(f"No intro template for {folder_path}, cannot detect the intro live.")
+
     if start_time:
         process = subprocess.Popen(['vlc', '--no-random', '--play-and-exit', f"--start-time={start_time}", video_path, '/dev/doesnt_exist', "vlc://quit"], stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+    elif template:
+        port = find_free_port()
+        process = subprocess.Popen(['vlc', '--no-random', '--play-and-exit', '--extraintf', 'rc', f"--rc-host=127.0.0.1:{port}", video_path, '/dev/doesnt_exist', "vlc://quit"], stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        stop_event = threading.Event()
+        worker = threading.Thread(target=skip_intro_live, args=(video_path, template, port, stop_event, intro_skipper_file), daemon=True)
+        worker.start()
     else:
         process = subprocess.Popen(['vlc', '--no-random', '--play-and-exit', video_path, '/dev/doesnt_exist', "vlc://quit"], stderr=subprocess.PIPE, stdout=subprocess.PIPE)
 
     # Wait until the VLC process ends and capture stdout and stderr
     stdout, stderr = process.communicate()
 
+    if template:
+        stop_event.set()
+        worker.join()
+
     return stdout.decode(), stderr.decode()
 
 def main():
@@ -298,6 +927,10 @@ def main():
         unittest.main()
         sys.exit(0)
     
+    if args.simulate > 0:
+        print_simulation(simulate_selection(args.simulate, args.simulate_plays, args.simulate_strategy, args.seed, trace_memory=args.simulate_memory))
+        sys.exit(0)
+
     if args.maindir == "":
         console.print("[red]--maindir needs to be set[/red]")
         sys.exit(1)
@@ -321,14 +954,32 @@ def main():
     if len(mp4_files) == 0:
         error("No .mp4 files found.", 3)
 
+    # Every play ever made, .db.txt only keeps the newest one per file
+    archive_dir = os.path.join(os.getenv("HOME"), '.db_archive')
+
+    if args.stats:
+        stats = compute_play_stats(mp4_files, *load_play_archive(archive_dir), time.time())
+        print_play_stats(stats)
+        return
+
     # Load existing entries from .db.txt
     db_file_path = os.path.join(os.getenv("HOME"), '.db.txt')
+    clean_db_file(db_file_path)
     db_entries = load_db_file(db_file_path)
 
+    if args.fingerprints:
+        index_path = os.path.join(os.getenv("HOME"), '.db_fingerprints.txt')
+        fingerprint_index = load_fingerprint_index(index_path)
+        rekey_renamed_files(mp4_files, db_file_path, fingerprint_index, archive_dir)
+        save_fingerprint_index(index_path, fingerprint_index)
+
     last_played_file = None  # Track the last played file
 
     # Loop to continuously select and play video files
     while True:
+        # Pick up plays appended by other watcher instances in the meantime
+        follow_db_file(db_file_path, db_entries)
+
         # Select an MP4 file to play
         selected_file = select_mp4_file(mp4_files, db_file_path, last_played_file)
 
@@ -351,6 +1002,7 @@ def main():
             current_time = int(time.time())
             # Update on disk
             update_db_file(db_file_path, selected_file, current_time)
+            archive_play(archive_dir, selected_file, current_time)
             # Update in memory so weights are recalculated correctly
             normalized_path = os.path.normpath(selected_file).replace('/', '').replace('\\', '')
             db_entries[normalized_path] = current_time
@@ -462,13 +1114,16 @@ class TestMainFunctions(unittest.TestCase):
         with self.assertRaises(SystemExit):
             find_series_directory('SeriesA', '/dummy_maindir')
 
-    @patch('builtins.open', new_callable=mock_open)
-    def test_update_db_file_with_new_entry(self, mock_open):
-        mock_file = mock_open.return_value.__enter__.return_value
-        mock_file.read.return_value = ''
-        
-        update_db_file('/dummy_db_path/.db.txt', 'file2.mp4', 987654321)
-        mock_file.write.assert_called_with('file2.mp4:::987654321\n')
+    def test_update_db_file_with_new_entry(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_file_path = os.path.join(tmpdir, '.db.txt')
+            with open(db_file_path, 'w') as db_file:
+                db_file.write('"file1.mp4":::123456789\n')
+
+            update_db_file(db_file_path, 'file2.mp4', 987654321)
+
+            with open(db_file_path) as db_file:
+                self.assertEqual(db_file.readlines(), ['"file1.mp4":::123456789\n', '"file2.mp4":::987654321\n'])
 
     @patch('os.listdir')
     @patch('os.path.isdir')
@@ -479,6 +1134,216 @@ class TestMainFunctions(unittest.TestCase):
         result = find_series_directory('SeriesA', '/dummy_maindir')
         self.assertEqual(result, '/dummy_maindir/ SeriesA')
 
+    def test_follow_db_file_reads_only_appended_lines(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_file_path = os.path.join(tmpdir, '.db.txt')
+            update_db_file(db_file_path, '/serie/1/a.mp4', 100)
+            entries = load_db_file(db_file_path)
+            self.assertEqual(entries, {'serie1a.mp4': 100})
+
+            # Another instance appends, a partial line is still being written
+            update_db_file(db_file_path, '/serie/1/b.mp4', 200)
+            with open(db_file_path, 'a') as db_file:
+                db_file.write('"/serie/1/a.mp4":::3')
+
+            follow_db_file(db_file_path, entries)
+            self.assertEqual(entries, {'serie1a.mp4': 100, 'serie1b.mp4': 200})
+
+            with open(db_file_path, 'a') as db_file:
+                db_file.write('00\n')
+
+            follow_db_file(db_file_path, entries)
+            self.assertEqual(entries['serie1a.mp4'], 300)
+
+    def test_clean_db_file_keeps_concurrent_appends(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_file_path = os.path.join(tmpdir, '.db.txt')
+            for i in range(3):
+                update_db_file(db_file_path, '/serie/1/a.mp4', 100 + i)
+            entries = load_db_file(db_file_path)
+
+            clean_db_file(db_file_path)
+            update_db_file(db_file_path, '/serie/1/b.mp4', 200)
+
+            with open(db_file_path) as db_file:
+                self.assertEqual(db_file.readlines(), ['"/serie/1/a.mp4":::102\n', '"/serie/1/b.mp4":::200\n'])
+
+            # The file was replaced, so it is read again from the start
+            follow_db_file(db_file_path, entries)
+            self.assertEqual(entries, {'serie1a.mp4': 102, 'serie1b.mp4': 200})
+
+    def test_play_archive_stats(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            archive_dir = os.path.join(tmpdir, '.db_archive')
+            day = 86400
+            now = 1000 * day
+            archive_play(archive_dir, '/serie/1/a.mp4', now - 40 * day)
+            archive_play(archive_dir, '/serie/1/a.mp4', now - 2 * day)
+            archive_play(archive_dir, '/serie/2/c.mp4', now - 400 * day)
+            archive_play(archive_dir, '/other/1/x.mp4', now)
+
+            episode_paths, episode_ids, timestamps = load_play_archive(archive_dir)
+            self.assertEqual(episode_paths, ['/serie/1/a.mp4', '/serie/2/c.mp4', '/other/1/x.mp4'])
+            self.assertEqual(episode_ids.tolist(), [0, 0, 1, 2])
+
+            stats = compute_play_stats(['/serie/1/a.mp4', '/serie/1/b.mp4', '/serie/2/c.mp4', '/serie/10/d.mp4'], episode_paths, episode_ids, timestamps, now)
+            self.assertEqual(stats["seasons"], [1, 2, 10])
+            self.assertEqual(stats["plays_per_season"], [2, 1, 0])
+            self.assertEqual(stats["watched_per_season"], [1, 1, 0])
+            self.assertEqual(stats["never_watched"], 2)
+            self.assertEqual(stats["coverage"], 0.5)
+            self.assertEqual(stats["staleness_histogram"], [0, 1, 0, 0, 0, 1])
+
+    def test_play_archive_ignores_torn_record(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            archive_dir = os.path.join(tmpdir, '.db_archive')
+            archive_play(archive_dir, '/serie/1/a.mp4', 100)
+            with open(os.path.join(archive_dir, 'episode_ids.u32'), 'ab') as ids_file:
+                ids_file.write(b'\x00\x00\x00\x00')
+
+            self.assertEqual(load_play_archive(archive_dir)[1].tolist(), [0])
+            archive_play(archive_dir, '/serie/1/b.mp4', 200)
+            self.assertEqual(load_play_archive(archive_dir)[1].tolist(), [0, 1])
+            self.assertEqual(load_play_archive(archive_dir)[2].tolist(), [100, 200])
+
+    def test_fingerprint_file_samples_content(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            file_a = os.path.join(tmpdir, 'a.mp4')
+            file_b = os.path.join(tmpdir, 'b.mp4')
+            content = os.urandom(100000)
+            with open(file_a, 'wb') as file:
+                file.write(content)
+            with open(file_b, 'wb') as file:
+                file.write(content[:-1] + bytes([content[-1] ^ 1]))
+
+            self.assertNotEqual(fingerprint_file(file_a), fingerprint_file(file_b))
+            os.rename(file_b, os.path.join(tmpdir, 'c.mp4'))
+            self.assertEqual(fingerprint_file(file_a), fingerprint_file(file_a))
+            open(file_b, 'w').close()
+            self.assertEqual(fingerprint_file(file_b), "0-" + hashlib.blake2b(bytes(8), digest_size=16).hexdigest())
+
+    def test_rekey_renamed_files(self):
+        global db_entries
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_file_path = os.path.join(tmpdir, '.db.txt')
+            index_path = os.path.join(tmpdir, '.db_fingerprints.txt')
+            old_path = os.path.join(tmpdir, '1', 'old name.mp4')
+            os.makedirs(os.path.dirname(old_path))
+            with open(old_path, 'wb') as file:
+                file.write(os.urandom(50000))
+
+            archive_dir = os.path.join(tmpdir, '.db_archive')
+            update_db_file(db_file_path, old_path, 12345)
+            archive_play(archive_dir, old_path, 12345)
+            db_entries = load_db_file(db_file_path)
+            index = load_fingerprint_index(index_path)
+            rekey_renamed_files([old_path], db_file_path, index, archive_dir)
+            save_fingerprint_index(index_path, index)
+
+            new_path = os.path.join(tmpdir, '01', 'New Name.mp4')
+            os.renames(old_path, new_path)
+
+            db_entries = load_db_file(db_file_path)
+            index = load_fingerprint_index(index_path)
+            rekey_renamed_files([new_path], db_file_path, index, archive_dir)
+            save_fingerprint_index(index_path, index)
+
+            stats = compute_play_stats([new_path], *load_play_archive(archive_dir), 20000)
+            self.assertEqual(stats["never_watched"], 0)
+            self.assertEqual(stats["total_plays"], 1)
+
+            new_key = os.path.normpath(new_path).replace('/', '')
+            self.assertEqual(db_entries[new_key], 12345)
+            self.assertEqual(load_db_file(db_file_path)[new_key], 12345)
+            self.assertEqual(list(load_fingerprint_index(index_path)["by_fingerprint"].values()), [new_key])
+
+    def test_save_fingerprint_index_merges_concurrent_instances(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            index_path = os.path.join(tmpdir, '.db_fingerprints.txt')
+            first = load_fingerprint_index(index_path)
+            second = load_fingerprint_index(index_path)
+            for index, name in [(first, 'a.mp4'), (second, 'b.mp4')]:
+                mp4_file = os.path.join(tmpdir, name)
+                with open(mp4_file, 'wb') as file:
+                    file.write(os.urandom(50000))
+                index["by_fingerprint"][get_fingerprint(index, mp4_file)] = name
+                index["changed"] = True
+
+            save_fingerprint_index(index_path, first)
+            save_fingerprint_index(index_path, second)
+
+            merged = load_fingerprint_index(index_path)
+            self.assertEqual(sorted(merged["by_fingerprint"].values()), ['a.mp4', 'b.mp4'])
+            self.assertEqual(len(merged["by_stat"]), 2)
+
+    def test_find_intro_end(self):
+        template = ["ff00ff00ff00ff00", "0f0f0f0f0f0f0f0f", "00ff00ff00ff00ff"]
+        # The last intro frame stays on screen for a moment
+        hashes = ["123456789abcdef0", "fedcba9876543210"] + template + ["00ff00ff00ff00fe", "3333333333333333"]
+        self.assertEqual(find_intro_end(enumerate(hashes, start=1), template), 5)
+        self.assertIsNone(find_intro_end(enumerate(["123456789abcdef0"] * 6, start=1), template))
+
+    def test_is_plausible_intro_end(self):
+        self.assertTrue(is_plausible_intro_end(70, 40, 240))
+        self.assertTrue(is_plausible_intro_end(40, 40, 240))
+        # A 70 frame template matched at the end of the window
+        self.assertFalse(is_plausible_intro_end(235, 70, 240))
+        self.assertFalse(is_plausible_intro_end(240, 20, 240))
+
+    def test_find_intro_end_stops_reading_after_match(self):
+        template = ["ff00ff00ff00ff00", "0f0f0f0f0f0f0f0f"]
+
+        def frame_hashes():
+            yield from enumerate(template + ["3333333333333333"], start=1)
+            self.fail("Read more frames than needed")
+
+        self.assertEqual(find_intro_end(frame_hashes(), template), 2)
+
+    def test_select_mp4_file_with_injected_state(self):
+        mp4_files = ['/serie/1/a.mp4', '/serie/1/b.mp4', '/serie/1/c.mp4']
+        entries = {'serie1a.mp4': 100, 'serie1b.mp4': 200}
+        picks = [select_mp4_file(mp4_files, None, '/serie/1/c.mp4', entries, lambda: 300, random.Random(seed), check_exists=False) for seed in range(50)]
+
+        self.assertNotIn('/serie/1/c.mp4', picks)
+        self.assertEqual(picks, [select_mp4_file(mp4_files, None, '/serie/1/c.mp4', entries, lambda: 300, random.Random(seed), check_exists=False) for seed in range(50)])
+
+    def test_selection_strategies_pick_with_the_same_distribution(self):
+        now = 10000
+        mp4_files = [f'/serie/1/{i}.mp4' for i in range(6)]
+        for last_played_times in [[0, 0, 100, 5000, 9000, 9999], [50, 200, 100, 5000, 9000, 9999]]:
+            last_played_times = np.array(last_played_times, dtype=np.int64)
+            entries = {f'serie1{i}.mp4': int(t) for i, t in enumerate(last_played_times) if t}
+
+            # The rule: never played files first, otherwise weighted by seconds since the last play, not the last played file
+            candidates = np.arange(6) != 5
+            never_played = candidates & (last_played_times == 0)
+            weights = np.where(candidates, selection_weights(now, last_played_times), 0.0)
+            expected = (1 - NEVER_PLAYED_PREFERENCE * never_played.any()) * weights / weights.sum()
+            if never_played.any():
+                expected += NEVER_PLAYED_PREFERENCE * never_played / never_played.sum()
+
+            rng = random.Random(0)
+            picks = [select_mp4_file(mp4_files, None, mp4_files[5], entries, lambda: now, rng, check_exists=False) for _ in range(20000)]
+            frequencies = np.bincount([mp4_files.index(pick) for pick in picks], minlength=6) / len(picks)
+            np.testing.assert_allclose(frequencies, expected, atol=0.015)
+
+            rng = np.random.default_rng(0)
+            picks = [select_mp4_file_numpy(last_played_times, 5, now, rng) for _ in range(20000)]
+            frequencies = np.bincount(picks, minlength=6) / len(picks)
+            np.testing.assert_allclose(frequencies, expected, atol=0.015)
+
+    def test_simulate_selection(self):
+        for strategy in ['select_mp4_file', 'numpy']:
+            result = simulate_selection(40, 400, strategy, seed=1)
+            self.assertEqual(result, {**simulate_selection(40, 400, strategy, seed=1), "picks_per_second": result["picks_per_second"], "peak_memory_mb": result["peak_memory_mb"]})
+            self.assertEqual(result["never_played_picks"], 40)
+            self.assertIsNotNone(result["all_seen_after_plays"])
+            self.assertGreaterEqual(result["repeat_interval"]["min"], 2)
+            self.assertIsNone(result["peak_memory_mb"])
+
+        result = simulate_selection(40, 100, 'numpy', trace_memory=True)
+        self.assertGreater(result["peak_memory_mb"], 0)
+
 if __name__ == '__main__':
     try:
         main()
@@ -1,13 +1,21 @@
 import os
 import sys
 import re
+import json
+import time
+import resource
+from contextlib import contextmanager
 import imagehash
 import argparse
+import numpy as np
 import pandas as pd
 from PIL import Image
 from rich.console import Console
 from rich.progress import Progress
+from rich.table import Table
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
 
@@ -16,6 +24,9 @@ console = Console()
 # Global process variable
 process_tasks = []
 
+# Records of profile_stage(), None unless --profile is given
+stage_records = None
+
 def die(message):
     """Print an error message and exit."""
     console.print(f"[bold red]Error:[/bold red] {message}")
@@ -26,6 +37,141 @@ def debug_print(debug, message):
     if debug:
         console.print(f"[bold yellow]Debug:[/bold yellow] {message}")
 
+def read_io_counters():
+    """Return (bytes read, bytes written) of this process and its waited-for children."""
+    try:
+        with open("/proc/self/io") as fh:
+            counters = dict(line.split(": ") for line in fh.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+def cpu_seconds():
+    """Return the CPU time used by this process and its waited-for children."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+@contextmanager
+def profile_stage(stage, episode):
+    """Record wall time, CPU time and I/O of a stage for one episode if --profile is given.
+
+    The yielded dict can be given a "frames" count to calculate frames per second."""
+    record = {"stage": stage, "episode": episode, "frames": 0}
+    if stage_records is None:
+        yield record
+        return
+
+    read_before, written_before = read_io_counters()
+    cpu_before = cpu_seconds()
+    wall_before = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["wall"] = time.perf_counter() - wall_before
+        record["cpu"] = cpu_seconds() - cpu_before
+        read_after, written_after = read_io_counters()
+        if read_before is not None:
+            record["read"] = read_after - read_before
+            record["written"] = written_after - written_before
+        stage_records.append(record)
+
+def format_bytes(nr_of_bytes):
+    """Format a byte count for the profile table."""
+    if nr_of_bytes is None:
+        return "-"
+    return f"{nr_of_bytes / 1024 / 1024:.1f} MB"
+
+def print_profile(records):
+    """Print the --profile summary per stage and the wall time per episode and stage."""
+    stages = list(dict.fromkeys(record["stage"] for record in records))
+
+    table = Table(title="Time per stage")
+    for column in ["Stage", "Episodes", "Wall", "CPU", "Frames", "Frames/s", "Read", "Written"]:
+        table.add_column(column, justify="left" if column == "Stage" else "right")
+
+    for stage in stages:
+        stage_list = [record for record in records if record["stage"] == stage]
+        wall = sum(record["wall"] for record in stage_list)
+        frames = sum(record["frames"] for record in stage_list)
+        has_io = all("read" in record for record in stage_list)
+        table.add_row(
+            stage,
+            str(len({record["episode"] for record in stage_list})),
+            f"{wall:.2f}s",
+            f"{sum(record['cpu'] for record in stage_list):.2f}s",
+            str(frames) if frames else "-",
+            f"{frames / wall:.1f}" if frames and wall > 0 else "-",
+            format_bytes(sum(record["read"] for record in stage_list) if has_io else None),
+            format_bytes(sum(record["written"] for record in stage_list) if has_io else None)
+        )
+
+    console.print(table)
+
+    episodes = list(dict.fromkeys(record["episode"] for record in records))
+    per_episode = Table(title="Wall time per episode")
+    per_episode.add_column("Episode")
+    for stage in stages:
+        per_episode.add_column(stage, justify="right")
+
+    for episode in episodes:
+        walls = {}
+        for record in records:
+            if record["episode"] == episode:
+                walls[record["stage"]] = walls.get(record["stage"], 0) + record["wall"]
+        per_episode.add_row(episode, *[f"{walls[stage]:.2f}s" if stage in walls else "-" for stage in stages])
+
+    console.print(per_episode)
+
+def write_collapsed_stacks(profiler, output_path, max_stacks=5000):
+    """Write cProfile stats as collapsed stacks ("a;b;c microseconds"), as read by flamegraph.pl.
+
+    cProfile only knows caller/callee pairs, so the time of a function is split
+    over its callers in proportion to the time spent under each of them. A branch
+    worth less than 1/max_stacks of the total time is not expanded but counted on
+    its parent's stack, which bounds the walk no matter how many call paths exist."""
+    import pstats
+    stats = pstats.Stats(profiler).stats
+
+    def name(func):
+        filename, line, function = func
+        return f"{function} ({os.path.basename(filename)}:{line})"
+
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, (_, _, _, caller_ct) in callers.items():
+            callees.setdefault(caller, {})[func] = caller_ct
+
+    min_seconds = sum(tt for _, _, tt, _, _ in stats.values()) / max_stacks
+    collapsed = {}
+
+    def walk(func, stack, on_stack, share):
+        stack = stack + [name(func)]
+        key = ";".join(stack)
+        on_stack.add(func)
+        own_time = stats[func][2] * share
+        for callee, edge_time in callees.get(func, {}).items():
+            callee_total = stats[callee][3]
+            if callee_total <= 0 or callee in on_stack:
+                continue
+            if share * edge_time < min_seconds or len(stack) >= 100:
+                own_time += share * edge_time
+            else:
+                walk(callee, stack, on_stack, share * edge_time / callee_total)
+        on_stack.discard(func)
+        if own_time > 0:
+            collapsed[key] = collapsed.get(key, 0) + own_time
+
+    for func, (_, _, _, _, callers) in stats.items():
+        if not callers:
+            walk(func, [], set(), 1.0)
+
+    with open(output_path, "w") as fh:
+        for stack, seconds in collapsed.items():
+            microseconds = int(seconds * 1e6)
+            if microseconds > 0:
+                fh.write(f"{stack} {microseconds}\n")
+
 def run_command(command):
     """Run a shell command and track subprocess tasks."""
     debug_print(args.debug, f"Running command: {command}")
@@ -44,8 +190,11 @@ def extract_frames(video_path, output_dir):
         die("Failed to extract frames.")
     debug_print(args.debug, f"Extracted frames to {output_dir}")
 
-def analyze_images(tmpdir):
-    """Analyze images and return the last frame for each unique hash."""
+def analyze_images(tmpdir, episode_hashes=None):
+    """Analyze images and return the last frame for each unique hash.
+
+    If episode_hashes is a dict, it is filled with the (frame, hash) sequence
+    of every episode so a template can be built without hashing again."""
     hash_to_image = {}
     last_file_to_frame = {}
     info_file_path = os.path.join(tmpdir, ".intro_cutter_info.csv")
@@ -62,47 +211,316 @@ def analyze_images(tmpdir):
         if not os.path.isdir(dir_path):
             continue
 
-        for filename in os.listdir(dir_path):
-            if filename.endswith(".png"):
-                filepath = os.path.join(dir_path, filename)
-                this_hash = imagehash.average_hash(Image.open(filepath))
+        with profile_stage("hash", directory) as record:
+            for filename in os.listdir(dir_path):
+                if filename.endswith(".png"):
+                    filepath = os.path.join(dir_path, filename)
+                    this_hash = imagehash.average_hash(Image.open(filepath))
+                    record["frames"] += 1
 
-                if str(this_hash) not in hash_to_image:
-                    hash_to_image[str(this_hash)] = []
+                    if episode_hashes is not None:
+                        match = re.match(r"output_(\d*).png", filename)
+                        if match:
+                            episode_hashes.setdefault(directory, []).append((int(match.group(1)), str(this_hash)))
 
-                if str(this_hash) != "0000000000000000":
-                    hash_to_image[str(this_hash)].append(filepath)
-                    debug_print(args.debug, f"Hash {this_hash} for file {filepath}")
+                    if str(this_hash) not in hash_to_image:
+                        hash_to_image[str(this_hash)] = []
+
+                    if str(this_hash) != "0000000000000000":
+                        hash_to_image[str(this_hash)].append(filepath)
+                        debug_print(args.debug, f"Hash {this_hash} for file {filepath}")
 
     console.print(f"\n[cyan]Analyzing {len(hash_to_image)} unique hashes...[/cyan]")
 
     # Store hashes and frames if the option is enabled
     hashes_list = []
 
-    for k in sorted(hash_to_image, key=lambda k: len(hash_to_image[k]), reverse=True):
-        for item in hash_to_image[k]:
-            match = re.match(rf"{tmpdir}/(.*)/output_(\d*).png", item)
-            if match:
-                thisfile = match.group(1)
-                thisframe = int(match.group(2))
+    with profile_stage("analyze", "all") as record:
+        for k in sorted(hash_to_image, key=lambda k: len(hash_to_image[k]), reverse=True):
+            for item in hash_to_image[k]:
+                match = re.match(rf"{tmpdir}/(.*)/output_(\d*).png", item)
+                record["frames"] += 1
+                if match:
+                    thisfile = match.group(1)
+                    thisframe = int(match.group(2))
+
+                    if thisfile not in last_file_to_frame or last_file_to_frame[thisfile] < thisframe:
+                        last_file_to_frame[thisfile] = thisframe
+                        debug_print(args.debug, f"Found last frame for {thisfile}: {thisframe}")
 
-                if thisfile not in last_file_to_frame or last_file_to_frame[thisfile] < thisframe:
-                    last_file_to_frame[thisfile] = thisframe
-                    debug_print(args.debug, f"Found last frame for {thisfile}: {thisframe}")
-                    
-                    # Save to hashes list
-                    hashes_list.append({"hash": k, "filename": thisfile, "last_frame": thisframe})
+                        # Save to hashes list
+                        hashes_list.append({"hash": k, "filename": thisfile, "last_frame": thisframe})
 
     console.print(f"[green]Found last frames for {len(last_file_to_frame)} files.[/green]")
 
     # Save results to .intro_cutter_info.csv
     hash_info_file_path = os.path.join(tmpdir, "hashes_info.csv")
     debug_print(args.debug, f"Saving hash analysis results to {hash_info_file_path}")
-    hashes_df = pd.DataFrame(hashes_list)
-    hashes_df.to_csv(hash_info_file_path, index=False)
+    with profile_stage("csv", "all"):
+        hashes_df = pd.DataFrame(hashes_list)
+        hashes_df.to_csv(hash_info_file_path, index=False)
 
     return last_file_to_frame
 
+def get_template_path(video_dir):
+    """Return the path of the intro template, shared by all seasons of a series."""
+    return os.path.join(os.path.dirname(os.path.abspath(video_dir)), ".intro_template.csv")
+
+def hash_episode_frames(dir_path):
+    """Return the (frame, hash) sequence of the extracted frames of one episode."""
+    frame_hashes = []
+    for filename in os.listdir(dir_path):
+        match = re.match(r"output_(\d*).png", filename)
+        if match:
+            this_hash = imagehash.average_hash(Image.open(os.path.join(dir_path, filename)))
+            frame_hashes.append((int(match.group(1)), str(this_hash)))
+    return sorted(frame_hashes)
+
+def build_intro_template(episode_hashes, last_frames, min_length=4):
+    """Build the intro's hash sequence from the episodes analyze_images found.
+
+    The episode with the median last frame is used. Its intro runs from the
+    first to the last frame whose hash also occurs in another episode. The
+    last frames from analyze_images are not used as the intro end, since they
+    are the last frame of any frequent hash, usually the last extracted one."""
+    candidates = sorted((frame, name) for name, frame in last_frames.items() if name in episode_hashes)
+    if len(candidates) < 2:
+        return None
+
+    _, name = candidates[len(candidates) // 2]
+
+    episodes_per_hash = {}
+    for hashes in episode_hashes.values():
+        for this_hash in set(h for _, h in hashes):
+            episodes_per_hash[this_hash] = episodes_per_hash.get(this_hash, 0) + 1
+
+    frames = [h for _, h in sorted(episode_hashes[name])]
+    shared = [i for i, h in enumerate(frames) if episodes_per_hash[h] > 1 and h != "0000000000000000"]
+    if not shared or shared[-1] - shared[0] + 1 < min_length:
+        return None
+
+    return frames[shared[0]:shared[-1] + 1]
+
+def save_intro_template(template_path, template):
+    """Save the intro's hash sequence as CSV."""
+    pd.DataFrame({"offset": range(len(template)), "hash": template}).to_csv(template_path, index=False)
+
+def load_intro_template(template_path):
+    """Load the intro's hash sequence, or return None if there is no template."""
+    try:
+        template_df = pd.read_csv(template_path, dtype={"hash": str})
+    except FileNotFoundError:
+        return None
+    return template_df.sort_values("offset")["hash"].tolist()
+
+def hashes_to_array(hashes):
+    """Convert hex hash strings to an array of 64 bit integers."""
+    return np.array([int(h, 16) for h in hashes], dtype=np.uint64)
+
+def match_intro_template(frame_hashes, template, max_distance=8):
+    """Find the intro in an episode with a sliding window Hamming search.
+
+    frame_hashes is the (frame, hash) sequence of the episode. Returns
+    (last_intro_frame, mean_distance) of the best window, or None if its mean
+    Hamming distance per frame is larger than max_distance."""
+    if not template or len(frame_hashes) < len(template):
+        return None
+
+    sequence = hashes_to_array([h for _, h in frame_hashes])
+    windows = np.lib.stride_tricks.sliding_window_view(sequence, len(template))
+    xored = windows ^ hashes_to_array(template)
+    distances = np.unpackbits(xored.view(np.uint8), axis=1).sum(axis=1) / len(template)
+
+    best = int(np.argmin(distances))
+    if distances[best] > max_distance:
+        return None
+
+    return frame_hashes[best + len(template) - 1][0], float(distances[best])
+
+def hash_bit_planes(hashes):
+    """Convert hex hash strings to a (frames, 64) array of +1/-1 bits.
+
+    Black frames are set to 0, so they don't align unrelated episodes."""
+    values = hashes_to_array(hashes)
+    bits = (values[:, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+    planes = bits.astype(np.float32) * 2 - 1
+    planes[values == 0] = 0
+    return planes
+
+def align_episodes(episode_hashes, max_distance=10, min_confidence=0.6, min_length=4):
+    """Find the intro of every episode by aligning their hash sequences with each other.
+
+    The 64 bit planes of every episode are cross-correlated with those of every
+    other episode using the FFT, which gives the best shift for all pairs at once.
+    The episode that correlates best with all others (the medoid) is the reference:
+    the intro is the longest run of its frames that most aligned episodes share.
+
+    Returns (results, template). results maps each episode to the frame numbers
+    of the intro's "start" and "end", the "confidence" (fraction of intro frames
+    within max_distance bits of the medoid) and "flagged" if the confidence is
+    below min_confidence or the intro does not fit into the episode."""
+    names = sorted(name for name, frame_hashes in episode_hashes.items() if frame_hashes)
+    if len(names) < 2:
+        return {}, None
+
+    sequences = [[h for _, h in sorted(episode_hashes[name])] for name in names]
+    length = max(len(sequence) for sequence in sequences)
+
+    signals = np.zeros((len(names), length, 64), dtype=np.float32)
+    for i, sequence in enumerate(sequences):
+        signals[i, :len(sequence)] = hash_bit_planes(sequence)
+
+    # correlation[a, b, k] = sum over frames t and bits of a[t + k] * b[t], negative k at the end
+    spectra = np.fft.rfft(signals, n=2 * length, axis=1)
+    correlation = np.fft.irfft(np.einsum('atk,btk->abt', spectra, np.conj(spectra)), n=2 * length, axis=2)
+
+    peaks = correlation.max(axis=2)
+    np.fill_diagonal(peaks, 0)
+    medoid = int(np.argmax(peaks.sum(axis=1)))
+
+    lags = np.argmax(correlation[:, medoid], axis=1)
+    lags = np.where(lags < length, lags, lags - 2 * length)
+    lags[medoid] = 0
+
+    # For every medoid frame, which aligned episodes show (almost) the same picture
+    medoid_values = hashes_to_array(sequences[medoid])
+    matches = np.zeros((len(names), len(medoid_values)), dtype=bool)
+    for i, sequence in enumerate(sequences):
+        values = hashes_to_array(sequence)
+        positions = np.arange(len(medoid_values)) + lags[i]
+        valid = (positions >= 0) & (positions < len(values))
+        other = np.zeros(len(medoid_values), dtype=np.uint64)
+        other[valid] = values[positions[valid]]
+        distances = np.unpackbits((medoid_values ^ other).view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+        matches[i] = valid & (distances <= max_distance) & (medoid_values != 0) & (other != 0)
+
+    others = np.arange(len(names)) != medoid
+    shared = matches[others].mean(axis=0) >= 0.5
+
+    # Longest run of shared frames
+    best_start, best_length, run_start = 0, 0, None
+    for t, is_shared in enumerate(list(shared) + [False]):
+        if is_shared and run_start is None:
+            run_start = t
+        elif not is_shared and run_start is not None:
+            if t - run_start > best_length:
+                best_start, best_length = run_start, t - run_start
+            run_start = None
+
+    if best_length < min_length:
+        return {}, None
+
+    start, end = best_start, best_start + best_length - 1
+    results = {}
+    for i, name in enumerate(names):
+        frame_hashes = sorted(episode_hashes[name])
+        episode_start, episode_end = start + int(lags[i]), end + int(lags[i])
+        fits = episode_start >= 0 and episode_end < len(frame_hashes)
+        confidence = float(matches[others, start:end + 1].mean()) if i == medoid else float(matches[i, start:end + 1].mean())
+
+        results[name] = {
+            "start": frame_hashes[episode_start][0] if fits else None,
+            "end": frame_hashes[episode_end][0] if fits else None,
+            "confidence": confidence,
+            "flagged": not fits or confidence < min_confidence
+        }
+
+    return results, sequences[medoid][start:end + 1]
+
+def print_alignment(results):
+    """Print the intro found for every episode by align_episodes."""
+    table = Table(title="Intro alignment")
+    table.add_column("Episode")
+    table.add_column("Start", justify="right")
+    table.add_column("End", justify="right")
+    table.add_column("Confidence", justify="right")
+
+    for name, result in sorted(results.items()):
+        start = "-" if result["start"] is None else f"{result['start'] // 2}s"
+        end = "-" if result["end"] is None else f"{result['end'] // 2}s"
+        confidence = f"{result['confidence']:.0%}"
+        if result["flagged"]:
+            confidence = f"[red]{confidence} (skipped)[/red]"
+        table.add_row(name, start, end, confidence)
+
+    console.print(table)
+
+def read_intro_endtimes(intro_endtime_path):
+    """Return the file names that already have an entry in .intro_endtime."""
+    if not os.path.exists(intro_endtime_path):
+        return set()
+    with open(intro_endtime_path) as fh:
+        return {line.split(" ::: ")[0] for line in fh if " ::: " in line}
+
+def replace_intro_endtimes(intro_endtime_path, endtimes):
+    """Rewrite .intro_endtime with the given entries, keeping the lines of all other files."""
+    kept = []
+    if os.path.exists(intro_endtime_path):
+        with open(intro_endtime_path) as fh:
+            kept = [line.rstrip("\n") for line in fh if line.split(" ::: ")[0] not in endtimes]
+    with open(f"{intro_endtime_path}.tmp", "w") as fh:
+        for line in kept:
+            fh.write(f"{line}\n")
+        for file, t in endtimes.items():
+            fh.write(f"{file} ::: {t}\n")
+    os.replace(f"{intro_endtime_path}.tmp", intro_endtime_path)
+
+INTRO_CHAPTER_TITLE = re.compile(r"\b(intro|opening|op|vorspann|titelsequenz|titelmusik)\b", re.IGNORECASE)
+
+def probe_chapters(video_path):
+    """Read the container chapters of a video with ffprobe, without decoding any frames."""
+    command = f"ffprobe -v quiet -print_format json -show_chapters \"{video_path}\""
+    process = run_command(command)
+    stdout, stderr = process.communicate()
+
+    if process.returncode != 0:
+        debug_print(args.debug, f"ffprobe failed for {video_path}: {stderr.decode()}")
+        return []
+
+    try:
+        chapters = json.loads(stdout.decode()).get("chapters", [])
+        return [
+            {
+                "start": float(chapter["start_time"]),
+                "end": float(chapter["end_time"]),
+                "title": chapter.get("tags", {}).get("title", "")
+            } for chapter in chapters
+        ]
+    except (ValueError, KeyError) as e:
+        debug_print(args.debug, f"Cannot parse chapters of {video_path}: {e}")
+        return []
+
+def probe_all_chapters(video_dir, video_files, jobs):
+    """Read the chapters of all video files in parallel."""
+    paths = [os.path.join(video_dir, video_file) for video_file in video_files]
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        return dict(zip(video_files, executor.map(probe_chapters, paths)))
+
+def intro_end_from_chapters(chapters_by_file, tolerance=2, max_intro_end=180):
+    """Return the intro end in seconds for every file whose chapters mark it.
+
+    A chapter titled like an intro is used directly. Otherwise the end of the
+    first chapter is used if it is the same, within tolerance seconds, for at
+    least two episodes, since a varying first chapter is not an intro."""
+    endtimes = {}
+    first_chapter_ends = {}
+
+    for video_file, chapters in chapters_by_file.items():
+        intro = next((c for c in chapters if INTRO_CHAPTER_TITLE.search(c["title"])), None)
+        if intro is not None and intro["end"] <= max_intro_end:
+            endtimes[video_file] = int(intro["end"])
+        elif len(chapters) > 1 and chapters[0]["end"] <= max_intro_end:
+            first_chapter_ends[video_file] = chapters[0]["end"]
+
+    if len(first_chapter_ends) >= 2:
+        median_end = float(np.median(list(first_chapter_ends.values())))
+        consistent = {f: end for f, end in first_chapter_ends.items() if abs(end - median_end) <= tolerance}
+        if len(consistent) >= 2:
+            for video_file, end in consistent.items():
+                endtimes[video_file] = int(end)
+
+    return endtimes
+
 def main(args):
     if not os.path.isdir(args.dir):
         die(f"Directory '{args.dir}' does not exist")
@@ -111,10 +529,32 @@ def main(args):
     os.makedirs(tmpdir, exist_ok=True)
     debug_print(args.debug, f"Temporary directory created at {tmpdir}")
 
+    intro_endtime_path = f"{args.dir}/.intro_endtime"
+    template_path = get_template_path(args.dir)
+    # --align analyzes all episodes again and saves a new template
+    template = None if args.no_template or args.align else load_intro_template(template_path)
+
+    if template is not None:
+        console.print(f"[cyan]Using intro template {template_path} ({len(template)} frames)[/cyan]")
+        done = read_intro_endtimes(intro_endtime_path)
+    else:
+        done = set()
+
     # Process each video file
-    video_files = [f for f in os.listdir(args.dir) if f.endswith(".mp4")]
+    video_files = [f for f in os.listdir(args.dir) if f.endswith(".mp4") and f not in done]
     debug_print(args.debug, f"Found {len(video_files)} video files to process.")
 
+    # --align may run over an existing .intro_endtime since it replaces the entries it aligns
+    if template is None and not args.align and os.path.exists(intro_endtime_path):
+        console.print(f"\n[red]{intro_endtime_path} already exists.[/red]")
+        sys.exit(0)
+
+    # Episodes whose chapters already mark the intro don't need to be decoded
+    nr_of_episodes = len(video_files)
+    with profile_stage("chapters", "all"):
+        chapter_endtimes = intro_end_from_chapters(probe_all_chapters(args.dir, video_files, args.jobs))
+    video_files = [f for f in video_files if f not in chapter_endtimes]
+
     with Progress(transient=True) as progress:
         task = progress.add_task("[cyan]Processing videos...", total=len(video_files))
         for video_file in video_files:
@@ -125,28 +565,79 @@ def main(args):
             os.makedirs(output_dir, exist_ok=True)
             debug_print(args.debug, f"Output directory created for {video_file}: {output_dir}")
 
-            if not os.path.exists(f"{args.dir}/.intro_endtime"):
+            with profile_stage("extract", video_file) as record:
                 extract_frames(video_path, output_dir)
-            else:
-                console.print(f"\n[red]{args.dir}/.intro_endtime already exists.[/red]")
-                sys.exit(0)
+                record["frames"] = len(os.listdir(output_dir))
 
             progress.update(task, advance=1)
 
-        # Analyze images
-        last_frames = analyze_images(tmpdir)
-
-        with open(f"{args.dir}/.intro_endtime", 'a') as fh:
-            for filename, frame in last_frames.items():
-                t = frame // 2  # Adjust frame to time (assuming 2 fps)
-                file = os.path.basename(filename)
-                fh.write(f"{file} ::: {t}\n")
-                console.print(f"[green]{file} ::: {t}[/green]")
+        if not video_files:
+            last_frames = {}
+        elif template is not None:
+            # Match each new episode against the template instead of clustering
+            last_frames = {}
+            for video_file in video_files:
+                with profile_stage("hash", video_file) as record:
+                    frame_hashes = hash_episode_frames(os.path.join(tmpdir, video_file))
+                    record["frames"] = len(frame_hashes)
+                with profile_stage("match", video_file) as record:
+                    match = match_intro_template(frame_hashes, template, args.template_threshold)
+                    record["frames"] = len(frame_hashes)
+                if match is None:
+                    console.print(f"[yellow]No intro found in {video_file}. Try --no_template.[/yellow]")
+                    continue
+                last_frames[video_file] = match[0]
+                debug_print(args.debug, f"Template matched {video_file} up to frame {match[0]} (distance {match[1]:.1f})")
+        elif args.align:
+            # Align the hash sequences of all episodes instead of taking the last frequent hash
+            episode_hashes = {}
+            for video_file in video_files:
+                with profile_stage("hash", video_file) as record:
+                    episode_hashes[video_file] = hash_episode_frames(os.path.join(tmpdir, video_file))
+                    record["frames"] = len(episode_hashes[video_file])
+
+            with profile_stage("align", "all") as record:
+                alignment, new_template = align_episodes(episode_hashes, min_confidence=args.min_confidence)
+                record["frames"] = sum(len(frame_hashes) for frame_hashes in episode_hashes.values())
+
+            print_alignment(alignment)
+            last_frames = {name: result["end"] for name, result in alignment.items() if not result["flagged"]}
+
+            if new_template is not None:
+                save_intro_template(template_path, new_template)
+                console.print(f"[green]Saved intro template with {len(new_template)} frames to {template_path}[/green]")
+        else:
+            # Analyze images
+            episode_hashes = {}
+            last_frames = analyze_images(tmpdir, episode_hashes)
+
+            new_template = build_intro_template(episode_hashes, last_frames)
+            if new_template is not None:
+                save_intro_template(template_path, new_template)
+                console.print(f"[green]Saved intro template with {len(new_template)} frames to {template_path}[/green]")
+
+        endtimes = dict(chapter_endtimes)
+        for filename, frame in last_frames.items():
+            endtimes[os.path.basename(filename)] = frame // 2  # Adjust frame to time (assuming 2 fps)
+
+        if args.align:
+            replace_intro_endtimes(intro_endtime_path, endtimes)
+        else:
+            with open(intro_endtime_path, 'a') as fh:
+                for file, t in endtimes.items():
+                    fh.write(f"{file} ::: {t}\n")
+        for file, t in endtimes.items():
+            console.print(f"[green]{file} ::: {t}[/green]")
+
+    console.print(f"[cyan]{len(chapter_endtimes)} of {nr_of_episodes} episodes resolved from chapters without decoding.[/cyan]")
 
     # Wait for all subprocesses to complete
     for process in process_tasks:
         process.wait()
 
+    if stage_records:
+        print_profile(stage_records)
+
 class TestVideoProcessor(unittest.TestCase):
     @patch('subprocess.Popen')
     def test_run_command(self, mock_popen):
@@ -380,6 +871,179 @@ class TestVideoProcessor(unittest.TestCase):
             extract_frames("test_video.mp4", "./output")
 
 
+    def test_match_intro_template_finds_intro_end(self):
+        template = ["ff00ff00ff00ff00", "0f0f0f0f0f0f0f0f", "00ff00ff00ff00ff", "f0f0f0f0f0f0f0f0"]
+        frame_hashes = list(enumerate(["123456789abcdef0"] * 5 + template + ["fedcba9876543210"] * 3, start=1))
+        self.assertEqual(match_intro_template(frame_hashes, template), (9, 0.0))
+
+    def test_match_intro_template_no_match(self):
+        template = ["ff00ff00ff00ff00", "0f0f0f0f0f0f0f0f"]
+        frame_hashes = list(enumerate(["00ff00ff00ff00ff"] * 6, start=1))
+        self.assertIsNone(match_intro_template(frame_hashes, template))
+        self.assertIsNone(match_intro_template(frame_hashes[:1], template))
+
+    def test_build_intro_template_uses_shared_hashes(self):
+        intro = ["ff00ff00ff00ff00", "0f0f0f0f0f0f0f0f", "00ff00ff00ff00ff", "f0f0f0f0f0f0f0f0"]
+        episode_hashes = {
+            "a.mp4": list(enumerate(["1111111111111111"] + intro + ["2222222222222222"], start=1)),
+            "b.mp4": list(enumerate(["3333333333333333", "4444444444444444"] + intro, start=1)),
+        }
+        last_frames = {"a.mp4": 6, "b.mp4": 6}
+        self.assertEqual(build_intro_template(episode_hashes, last_frames), intro)
+        self.assertIsNone(build_intro_template({"a.mp4": episode_hashes["a.mp4"]}, last_frames))
+
+    def test_build_intro_template_from_analyze_images(self):
+        rng = np.random.default_rng(3)
+        random_frames = lambda n: [rng.integers(0, 256, (16, 16), dtype=np.uint8) for _ in range(n)]
+        intro = random_frames(20)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, before, after in [("a.mp4", 5, 48), ("b.mp4", 10, 45), ("c.mp4", 2, 48)]:
+                os.makedirs(os.path.join(tmp, name))
+                for frame, pixels in enumerate(random_frames(before) + intro + random_frames(after), start=1):
+                    Image.fromarray(pixels).save(os.path.join(tmp, name, f"output_{frame:04d}.png"))
+
+            episode_hashes = {}
+            last_frames = analyze_images(tmp, episode_hashes)
+            template = build_intro_template(episode_hashes, last_frames)
+
+        intro_hashes = [str(imagehash.average_hash(Image.fromarray(pixels))) for pixels in intro]
+        self.assertEqual(template, intro_hashes)
+
+    def test_intro_template_roundtrip(self):
+        template = ["00000000000000ff", "ff00ff00ff00ff00"]
+        with tempfile.TemporaryDirectory() as tmp:
+            template_path = os.path.join(tmp, ".intro_template.csv")
+            self.assertIsNone(load_intro_template(template_path))
+            save_intro_template(template_path, template)
+            self.assertEqual(load_intro_template(template_path), template)
+
+    def test_replace_intro_endtimes_keeps_other_entries(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            intro_endtime_path = os.path.join(tmp, ".intro_endtime")
+            with open(intro_endtime_path, "w") as fh:
+                fh.write("a.mp4 ::: 40\nflagged.mp4 ::: 12")
+            replace_intro_endtimes(intro_endtime_path, {"a.mp4": 45, "new.mp4": 30})
+            with open(intro_endtime_path) as fh:
+                lines = fh.read().splitlines()
+
+        self.assertEqual(lines, ["flagged.mp4 ::: 12", "a.mp4 ::: 45", "new.mp4 ::: 30"])
+
+    def test_intro_end_from_chapters(self):
+        chapters_by_file = {
+            "titled.mp4": [{"start": 0, "end": 20.5, "title": "Cold Open"}, {"start": 20.5, "end": 51.2, "title": "Opening"}, {"start": 51.2, "end": 1300, "title": "Part A"}],
+            "a.mp4": [{"start": 0, "end": 45.1, "title": "Chapter 1"}, {"start": 45.1, "end": 1300, "title": "Chapter 2"}],
+            "b.mp4": [{"start": 0, "end": 44.2, "title": "Chapter 1"}, {"start": 44.2, "end": 1300, "title": "Chapter 2"}],
+            "odd.mp4": [{"start": 0, "end": 100, "title": "Chapter 1"}, {"start": 100, "end": 1300, "title": "Chapter 2"}],
+            "none.mp4": []
+        }
+        self.assertEqual(intro_end_from_chapters(chapters_by_file), {"titled.mp4": 51, "a.mp4": 45, "b.mp4": 44})
+
+    def test_intro_end_from_chapters_single_first_chapter_is_not_trusted(self):
+        chapters_by_file = {"a.mp4": [{"start": 0, "end": 45, "title": ""}, {"start": 45, "end": 1300, "title": ""}]}
+        self.assertEqual(intro_end_from_chapters(chapters_by_file), {})
+
+    @patch('subprocess.Popen')
+    def test_probe_chapters(self, mock_popen):
+        mock_process = MagicMock()
+        mock_process.returncode = 0
+        mock_process.communicate.return_value = (b'{"chapters": [{"start_time": "0.000000", "end_time": "42.000000", "tags": {"title": "Intro"}}]}', b'')
+        mock_popen.return_value = mock_process
+
+        self.assertEqual(probe_chapters("video.mp4"), [{"start": 0.0, "end": 42.0, "title": "Intro"}])
+
+        mock_process.returncode = 1
+        self.assertEqual(probe_chapters("video.mp4"), [])
+
+    def test_profile_stage_records_only_when_enabled(self):
+        with profile_stage("hash", "a.mp4") as record:
+            record["frames"] = 10
+        self.assertNotIn("wall", record)
+
+        records = []
+        with patch.object(sys.modules[__name__], "stage_records", records):
+            with profile_stage("hash", "a.mp4") as record:
+                record["frames"] = 10
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["frames"], 10)
+        self.assertGreaterEqual(records[0]["wall"], 0)
+        self.assertGreaterEqual(records[0]["cpu"], 0)
+
+    def test_write_collapsed_stacks(self):
+        import cProfile
+
+        def inner():
+            return sum(i * i for i in range(20000))
+
+        def outer():
+            return inner()
+
+        profiler = cProfile.Profile()
+        profiler.runcall(outer)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            output_path = os.path.join(tmp, "stacks.txt")
+            write_collapsed_stacks(profiler, output_path)
+            with open(output_path) as fh:
+                lines = fh.read().splitlines()
+
+        self.assertTrue(lines)
+        self.assertTrue(all(line.rsplit(" ", 1)[1].isdigit() for line in lines))
+        self.assertTrue(any(line.startswith("outer (") and ";inner (" in line for line in lines))
+
+    def test_write_collapsed_stacks_on_pipeline_profile(self):
+        import cProfile
+        rng = np.random.default_rng(5)
+        random_frames = lambda n: [rng.integers(0, 256, (16, 16), dtype=np.uint8) for _ in range(n)]
+        intro = random_frames(8)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, before in [("a.mp4", 3), ("b.mp4", 5), ("c.mp4", 1), ("d.mp4", 4)]:
+                os.makedirs(os.path.join(tmp, name))
+                for frame, pixels in enumerate(random_frames(before) + intro + random_frames(5), start=1):
+                    Image.fromarray(pixels).save(os.path.join(tmp, name, f"output_{frame:04d}.png"))
+
+            def pipeline():
+                episode_hashes = {}
+                last_frames = analyze_images(tmp, episode_hashes)
+                align_episodes(episode_hashes)
+                save_intro_template(os.path.join(tmp, ".intro_template.csv"), build_intro_template(episode_hashes, last_frames))
+                load_intro_template(os.path.join(tmp, ".intro_template.csv"))
+
+            profiler = cProfile.Profile()
+            profiler.runcall(pipeline)
+
+            output_path = os.path.join(tmp, "stacks.txt")
+            start = time.perf_counter()
+            write_collapsed_stacks(profiler, output_path)
+            elapsed = time.perf_counter() - start
+            with open(output_path) as fh:
+                lines = fh.read().splitlines()
+
+        self.assertLess(elapsed, 2)
+        self.assertTrue(any(";analyze_images (" in line for line in lines))
+
+    def test_align_episodes_finds_shifted_intro(self):
+        random_hashes = lambda n: [f"{int(x):016x}" for x in np.random.default_rng(n).integers(1, 2**63, n, dtype=np.int64)]
+        intro = [f"{int(x):016x}" for x in np.random.default_rng(0).integers(1, 2**63, 20, dtype=np.int64)]
+        episode_hashes = {
+            "a.mp4": list(enumerate(random_hashes(5) + intro + random_hashes(35), start=1)),
+            "b.mp4": list(enumerate(random_hashes(12) + intro + random_hashes(28), start=1)),
+            "c.mp4": list(enumerate(["0000000000000000"] * 3 + intro + random_hashes(37), start=1)),
+            "recap.mp4": list(enumerate(random_hashes(60), start=1))
+        }
+
+        results, template = align_episodes(episode_hashes)
+        self.assertEqual(template, intro)
+        self.assertEqual((results["a.mp4"]["start"], results["a.mp4"]["end"]), (6, 25))
+        self.assertEqual((results["b.mp4"]["start"], results["b.mp4"]["end"]), (13, 32))
+        self.assertEqual((results["c.mp4"]["start"], results["c.mp4"]["end"]), (4, 23))
+        self.assertFalse(results["b.mp4"]["flagged"])
+        self.assertTrue(results["recap.mp4"]["flagged"])
+
+    def test_align_episodes_needs_two_episodes(self):
+        self.assertEqual(align_episodes({"a.mp4": [(1, "ff00ff00ff00ff00")]}), ({}, None))
+
 
 if __name__ == "__main__":
     try:
@@ -388,13 +1052,32 @@ if __name__ == "__main__":
         parser.add_argument("--tmp", type=str, default="./tmp", help="Temporary directory for extracted frames.")
         parser.add_argument("--debug", action='store_true', help="Enable debug output.")
         parser.add_argument("--save_hashes", action='store_true', help="Save hashes and frames to CSV.")
+        parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Number of videos probed for chapters in parallel.")
+        parser.add_argument("--profile", action='store_true', help="Print wall time, CPU time, frames per second and I/O per stage and episode.")
+        parser.add_argument("--profile_output", type=str, default="", help="Write cProfile stats as collapsed stacks for flamegraph.pl to this file (implies --profile).")
+        parser.add_argument("--align", action='store_true', help="Find intro start and end by aligning all episodes with FFT cross-correlation. Implies --no_template, replaces the series' template and rewrites the .intro_endtime entries of confidently aligned episodes.")
+        parser.add_argument("--min_confidence", type=float, default=0.6, help="Episodes aligned with a lower confidence are not written to .intro_endtime.")
+        parser.add_argument("--no_template", action='store_true', help="Ignore the series' intro template and analyze all episodes again.")
+        parser.add_argument("--template_threshold", type=float, default=8, help="Maximum mean Hamming distance per frame for a template match.")
 
         args = parser.parse_args()
 
         if os.getenv('tests'):
             unittest.main(argv=[sys.argv[0]])
 
-        main(args)
+        if args.profile or args.profile_output:
+            stage_records = []
+
+        if args.profile_output:
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.runcall(main, args)
+            finally:
+                write_collapsed_stacks(profiler, args.profile_output)
+                console.print(f"[cyan]Wrote collapsed stacks to {args.profile_output}[/cyan]")
+        else:
+            main(args)
     except KeyboardInterrupt:
         console.print("[bold yellow]You cancelled the operation.[/bold yellow]")
         sys.exit(0)